@@ -1,6 +1,7 @@
 # main.py
 import os
 import sys
+import asyncio
 from src.prompt_tester import PromptTester
 from dotenv import load_dotenv
 
@@ -34,7 +35,7 @@ def main():
 
         # Run all test prompts
         print("Running prompt tests...\n")
-        tester.run_tests()
+        asyncio.run(tester.run_tests())
         
         print(f"\nTests completed successfully!")
         print(f"Results saved in: {tester.output_folder}")
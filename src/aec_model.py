@@ -1,17 +1,23 @@
 # src/aec_model.py
 import os
+import re
+import asyncio
+import httpx
 import google.generativeai as genai
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from .semantic_cache import SemanticCache
+from .llm_retry import llm_retry, get_rate_limiter
 
 
 class AECModel:
     """
     Unified model class supporting both Gemini and OpenAI providers.
     """
-    def __init__(self, config):
-        self.provider = (config.get("models", "provider", "gemini") or "gemini").lower()
-        self.model_name = config.get("models", "aec_model", "gemini-2.5-flash")
-        self.temperature = config.get("models", "temperature", 0.1)
+    def __init__(self, config, embedder=None):
+        models = config.section("models")
+        self.provider = (models.get("provider", "gemini") or "gemini").lower()
+        self.model_name = models.get("aec_model", "gemini-2.5-flash")
+        self.temperature = models.get("temperature", 0.1)
 
         if self.provider == "gemini":
             api_key = os.getenv("GEMINI_API_KEY")
@@ -27,27 +33,81 @@ class AECModel:
             api_key = os.getenv("OPENAI_API_KEY")
             if not api_key:
                 raise ValueError("Missing OPENAI_API_KEY environment variable.")
-            self.client = OpenAI(api_key=api_key)
+            # One pooled HTTP/2 connection set for all calls; retries are handled by llm_retry
+            self.client = AsyncOpenAI(
+                api_key=api_key,
+                http_client=DefaultAsyncHttpxClient(http2=True, limits=httpx.Limits(max_connections=100)),
+                max_retries=0
+            )
 
         else:
             raise ValueError(f"Unsupported provider: {self.provider}")
 
-    def generate_response(self, prompt: str) -> str:
+        self.rate_limiter = get_rate_limiter(self.provider, models.get("requests_per_second", 5))
+
+        # Response cache, persisted per (provider, model, temperature)
+        self.cache = None
+        cache_config = config.section("cache")
+        if embedder is not None and cache_config.get("enabled", True):
+            cache_folder = cache_config.get("folder", "cache")
+            cache_name = re.sub(r"[^\w.-]", "_", f"{self.provider}_{self.model_name}_t{self.temperature}")
+            self.cache = SemanticCache(
+                embedder,
+                threshold=cache_config.get("similarity_threshold", 0.95),
+                path=os.path.join(cache_folder, f"{cache_name}.pkl")
+            )
+
+    async def generate_response(self, prompt: str, cache_key: str = None, system_prompt: str = None,
+                                cache_scope: str = None) -> str:
         """
         Generate response using the configured provider.
+        system_prompt is a static instruction prefix sent ahead of prompt so the
+        provider can reuse its prompt cache across calls.
+        Exact prompt repeats are served from the cache. When cache_key is given,
+        a semantically close cache_key is a hit too, but only among entries with
+        the same system prompt, temperature and cache_scope (e.g. the retrieved context).
         """
+        exact_key = f"{self.temperature}\0{system_prompt or ''}\0{prompt}"
+        scope = f"{self.temperature}\0{system_prompt or ''}\0{cache_scope or ''}"
+        embedding = None
+        if self.cache is not None:
+            cached = self.cache.get(exact_key)
+            if cached is None and cache_key:
+                # Embed only on an exact miss; the forward pass is CPU/GPU-bound, so keep it off the event loop
+                embedding = await asyncio.to_thread(self.cache.embed, cache_key)
+                cached = self.cache.get(exact_key, embedding, scope)
+            if cached is not None:
+                return cached
+
         try:
+            text = await self._call_provider(prompt, system_prompt)
+        except Exception as e:
+            return f"Error generating response: {str(e)}"
+
+        if self.cache is not None:
+            self.cache.put(exact_key, text, embedding, scope)
+        return text
+
+    @llm_retry
+    async def _call_provider(self, prompt: str, system_prompt: str = None) -> str:
+        async with self.rate_limiter:
             if self.provider == "gemini":
-                response = self.client.generate_content(prompt)
+                # Gemini caches identical prompt prefixes implicitly
+                response = await self.client.generate_content_async((system_prompt or "") + prompt)
                 return response.text if hasattr(response, "text") else "<no response>"
 
-            elif self.provider == "openai":
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=self.temperature
-                )
-                return response.choices[0].message.content or "<no response>"
+            # OpenAI caches the system message automatically once it is >= 1024 tokens
+            messages = [{"role": "user", "content": prompt}]
+            if system_prompt:
+                messages.insert(0, {"role": "system", "content": system_prompt})
+            response = await self.client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                temperature=self.temperature
+            )
+            return response.choices[0].message.content or "<no response>"
 
-        except Exception as e:
-            return f"Error generating response: {str(e)}"
\ No newline at end of file
+    def save_cache(self):
+        """Persist the response cache, if enabled."""
+        if self.cache is not None:
+            self.cache.save()
@@ -1,6 +1,7 @@
 # src/config_loader.py
 import yaml
 import os
+from types import MappingProxyType
 
 
 class ConfigLoader:
@@ -9,6 +10,7 @@ class ConfigLoader:
             raise FileNotFoundError(f"Config file not found: {config_file}")
         with open(config_file, "r", encoding="utf-8") as f:
             self.config = yaml.safe_load(f)
+        self._sections = {}
 
     def get(self, section: str, key: str = None, default=None):
         """
@@ -25,3 +27,13 @@ class ConfigLoader:
             return section_data if section_data else default
         return section_data.get(key, default)
 
+    def section(self, name: str):
+        """
+        Read-only view of a top-level mapping section (empty if missing).
+        Views are built once, so modules can bind them in __init__ and
+        read keys with a single dict lookup.
+        """
+        if name not in self._sections:
+            data = (self.config or {}).get(name) or {}
+            self._sections[name] = MappingProxyType(data if isinstance(data, dict) else {})
+        return self._sections[name]
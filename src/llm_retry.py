@@ -0,0 +1,43 @@
+# src/llm_retry.py
+import openai
+from aiolimiter import AsyncLimiter
+from google.api_core import exceptions as google_exceptions
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+
+# Transient provider errors (rate limits, timeouts, 5xx) that are worth retrying
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
+
+# Exponential backoff with jitter; the last error is re-raised to the caller
+llm_retry = retry(
+    wait=wait_exponential_jitter(initial=1, max=30),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    reraise=True,
+)
+
+_limiters = {}
+
+
+def get_rate_limiter(provider: str, requests_per_second: float) -> AsyncLimiter:
+    """
+    Shared request limiter per provider, so every caller of the same API
+    (e.g. AECModel and QueryTransformer on Gemini) paces against one budget.
+    """
+    if not requests_per_second or requests_per_second <= 0:
+        raise ValueError(f"models.requests_per_second must be > 0, got {requests_per_second!r}")
+    if provider not in _limiters:
+        if requests_per_second >= 1:
+            _limiters[provider] = AsyncLimiter(requests_per_second, 1)
+        else:
+            # Sub-1 rates (e.g. 10 RPM = 0.16/s): one request per 1/rate seconds, so capacity stays >= 1
+            _limiters[provider] = AsyncLimiter(1, 1 / requests_per_second)
+    return _limiters[provider]
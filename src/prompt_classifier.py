@@ -1,26 +1,32 @@
 # src/prompt_classifier.py
-import json
 import re
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional; stdlib json accepts the same str/bytes input
+    from json import loads as json_loads
 from .aec_model import AECModel
+from .prompt_template import PromptTemplate
 
 
 class PromptClassifier:
     def __init__(self, config, aec_model: AECModel):
-        self.template = config.get("prompts", "prompt_classification", "{question}\n{response}")
+        self.template = PromptTemplate(
+            config.section("prompts").get("prompt_classification", "{question}\n{response}")
+        )
         self.model = aec_model
 
-    def classify(self, question: str, model_response: str) -> dict:
+    async def classify(self, question: str, model_response: str) -> dict:
         """
         Classify question/response pair for security issues.
         """
         try:
             prompt = self.template.format(question=question, response=model_response)
-            response_text = self.model.generate_response(prompt).strip()
+            response_text = (await self.model.generate_response(prompt)).strip()
 
             # Extract JSON from response
             match = re.search(r"\{.*\}", response_text, re.DOTALL)
             if match:
-                result = json.loads(match.group())
+                result = json_loads(match.group())
                 # Ensure all required fields exist with proper defaults
                 return {
                     "is_question_malicious": result.get("is_question_malicious", False),
@@ -0,0 +1,50 @@
+# src/prompt_template.py
+import re
+import string
+
+
+def split_static_prefix(template: str) -> tuple[str, str]:
+    """
+    Split a str.format template into a placeholder-free prefix and the rest.
+    The cut is made at the last blank line before the first placeholder, so
+    the section that introduces it stays with the dynamic part.
+    Returns: (static_prefix, dynamic_template). The prefix is already unescaped
+    ('{{' -> '{'); the dynamic part is still a format template.
+    """
+    first_field = None
+    for match in re.finditer(r"\{+", template):
+        # An odd run of braces ends in a real placeholder; even runs are escapes
+        if len(match.group()) % 2:
+            first_field = match.end() - 1
+            break
+    if first_field is None:
+        return "", template
+
+    cut = template.rfind("\n\n", 0, first_field)
+    cut = cut + 2 if cut != -1 else first_field
+    static = template[:cut].replace("{{", "{").replace("}}", "}")
+    return static, template[cut:]
+
+
+class PromptTemplate:
+    """
+    str.format template parsed once into literal/field parts, so rendering is
+    plain concatenation instead of re-parsing the format string on every call.
+    Only bare '{name}' fields are precompiled; anything else falls back to str.format.
+    """
+    def __init__(self, template: str):
+        self.template = template
+        self._parts = []
+        self._compiled = True
+        for literal, field, format_spec, conversion in string.Formatter().parse(template):
+            if literal:
+                self._parts.append((literal, None))
+            if field is not None:
+                if not field.isidentifier() or format_spec or conversion:
+                    self._compiled = False
+                self._parts.append((None, field))
+
+    def format(self, **values) -> str:
+        if not self._compiled:
+            return self.template.format(**values)
+        return "".join(text if field is None else str(values[field]) for text, field in self._parts)
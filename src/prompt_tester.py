@@ -1,13 +1,21 @@
 # src/prompt_tester.py
 import os
-import json
 import re
+import json
+import asyncio
 import pandas as pd
+import xlsxwriter
+from tqdm import tqdm
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional; stdlib json accepts the same str/bytes input
+    from json import loads as json_loads
 from .config_loader import ConfigLoader
 from .aec_model import AECModel
 from .prompt_classifier import PromptClassifier
 from .query_transformer import QueryTransformer
 from .rag_system import RAGSystem
+from .prompt_template import PromptTemplate, split_static_prefix
 
 
 def flatten_list(l):
@@ -26,153 +34,289 @@ class PromptTester:
         # Load config safely
         self.config = ConfigLoader(config_file)
 
+        # Bind config sections once
+        models = self.config.section("models")
+        paths = self.config.section("paths")
+        messages = self.config.section("messages")
+        results = self.config.section("results")
+
         # Load model/config parameters
-        self.wait_time = self.config.get("models", "wait_time", default=60)
-        self.aec_prompt = self.config.get(
-            "prompts", "AEC_system_prompt", default="{context}\n{conversation_history}\n{question}"
+        self.wait_time = models.get("wait_time", 60)
+        self.concurrency = models.get("concurrency", 5)
+        self.batch_size = models.get("batch_size", 20)
+        # Static instructions first and per-test fields last, so providers can cache the prefix
+        aec_template = self.config.section("prompts").get(
+            "AEC_system_prompt", "{conversation_history}\n{context}\n{question}"
         )
+        self.aec_system_prompt, aec_prompt = split_static_prefix(aec_template)
+        self.aec_prompt = PromptTemplate(aec_prompt)
 
         # Load paths and test prompts
-        test_prompts_file = self.config.get("paths", "test_prompts", default="config/test_prompts2.json")
-        with open(test_prompts_file, "r", encoding="utf-8") as f:
-            self.test_prompts2 = json.load(f)
+        test_prompts_file = paths.get("test_prompts", "config/test_prompts2.json")
+        with open(test_prompts_file, "rb") as f:
+            self.test_prompts2 = json_loads(f.read())
 
-        self.output_folder = self.config.get("paths", "outputs", default="outputs")
+        self.output_folder = paths.get("outputs", "outputs")
         os.makedirs(self.output_folder, exist_ok=True)
+        self.save_excel = results.get("excel", True)
+        self.save_parquet = results.get("parquet", False)
 
         # Messages
-        self.deny_message = self.config.get("messages", "deny", default="Access Denied: Malicious content detected.")
-        self.invalid_query_message = self.config.get("messages", "invalid", default="This question is not valid.")
+        self.deny_message = messages.get("deny", "Access Denied: Malicious content detected.")
+        self.invalid_query_message = messages.get("invalid", "This question is not valid.")
 
         # Flatten sensitive_keywords safely
         raw_keywords = self.config.get("sensitive_keywords", default=[])
         self.sensitive_keywords = flatten_list(raw_keywords)
+        self._compile_sensitive_keywords()
 
-        # Initialize modules
-        self.model = AECModel(self.config)
+        # Initialize modules (the RAG embedder is shared with the response cache)
+        self.rag_system = RAGSystem(self.config)
+        self.model = AECModel(self.config, embedder=self.rag_system.model)
         self.classifier = PromptClassifier(self.config, self.model)
         self.query_transformer = QueryTransformer(self.config)
-        self.rag_system = RAGSystem(self.config)
 
-    def detect_sensitive_strings(self, text: str) -> list:
-        """Detect sensitive keywords in text."""
-        found = []
+    def _compile_sensitive_keywords(self):
+        """
+        Compile the valid sensitive keywords. Patterns without groups are joined
+        into one case-insensitive alternation; patterns with their own groups or
+        backreferences would clash with the alternation's named groups, so they
+        are kept out of it and searched one by one.
+        """
+        self._sensitive_patterns = []
+        self._sensitive_compiled = []
+        self._sensitive_separate = []
         for pat in self.sensitive_keywords:
             try:
-                if re.search(pat, text, flags=re.IGNORECASE):
-                    found.append(pat)
+                compiled = re.compile(pat, re.IGNORECASE)
             except re.error:
                 continue
-        return found
+            if compiled.groups or compiled.groupindex:
+                print(f"Warning: sensitive keyword {pat!r} uses groups; matching it separately.")
+                self._sensitive_separate.append((pat, compiled))
+                continue
+            self._sensitive_patterns.append(pat)
+            self._sensitive_compiled.append(compiled)
 
-    def run_tests(self):
-        """Execute all test prompts and generate results."""
-        print("Running prompt tests...\n")
-        results = []
+        self._sensitive_re = None
+        if self._sensitive_patterns:
+            try:
+                self._sensitive_re = re.compile(
+                    "|".join(f"(?P<p{i}>{pat})" for i, pat in enumerate(self._sensitive_patterns)),
+                    re.IGNORECASE
+                )
+            except re.error as e:
+                # Fall back to matching every keyword on its own
+                print(f"Warning: could not combine sensitive keywords ({e}); matching them separately.")
+                self._sensitive_separate = list(zip(self._sensitive_patterns, self._sensitive_compiled)) + self._sensitive_separate
+                self._sensitive_patterns, self._sensitive_compiled = [], []
 
+    def detect_sensitive_strings(self, text: str) -> list:
+        """Detect sensitive keywords in text (single scan over the combined pattern)."""
+        matched = set()
+        if self._sensitive_re is not None:
+            for m in self._sensitive_re.finditer(text):
+                matched.add(m.lastgroup)
+                # finditer reports one pattern per span; others matching inside it would be lost
+                start, end = m.span()
+                for i, compiled in enumerate(self._sensitive_compiled):
+                    if f"p{i}" not in matched and any(
+                        compiled.match(text, pos) for pos in range(start, max(end, start + 1))
+                    ):
+                        matched.add(f"p{i}")
+        found = {self._sensitive_patterns[int(group[1:])] for group in matched}
+        found.update(pat for pat, compiled in self._sensitive_separate if compiled.search(text))
+        # Report in config order, like a per-keyword scan would
+        return [pat for pat in self.sensitive_keywords if pat in found]
+
+    def redact_sensitive_strings(self, text: str) -> str:
+        """Replace every sensitive keyword match in text with [REDACTED]."""
+        if self._sensitive_re is not None:
+            text = self._sensitive_re.sub("[REDACTED]", text)
+        for _, compiled in self._sensitive_separate:
+            text = compiled.sub("[REDACTED]", text)
+        return text
+
+    async def run_tests(self):
+        """Execute all test prompts concurrently, in micro-batches, and generate results."""
+        print("Running prompt tests...\n")
         total_prompts = len(self.test_prompts2)
-        for idx, attack in enumerate(self.test_prompts2, 1):
-            attack_name = attack.get("attack_name", f"Prompt_{idx}")
-            original_question = attack.get("prompt", "")
-            print(f"[{idx}/{total_prompts}] Testing: {attack_name}")
-
-            # Transform query
-            transformed_question, is_malicious = self.query_transformer.transform(original_question)
-
-            # Defaults
-            context_text = "No context found."
-            model_response = ""
-            data_leaked_desc = "None"
-            response_safe_flag = True
-            response_safety_score = 10
-            question_comment = ""
-            response_comment = ""
-            is_question_malicious = is_malicious
-
-            if is_malicious or transformed_question in [self.deny_message, self.invalid_query_message]:
-                model_response = self.deny_message
-                question_comment = "Malicious query blocked by transformer."
-                response_comment = "No data retrieval or response generation performed."
-                data_leaked_desc = "None - blocked before data access"
-                context_text = "BLOCKED"
-                status = "BLOCKED"
-            else:
-                # Retrieve context
-                retrieved_list = self.rag_system.retrieve(transformed_question, top_k=3)
-                context_text = "\n\n".join(retrieved_list) if retrieved_list else "No context found."
-
-                # Detect sensitive data
-                found = self.detect_sensitive_strings(context_text)
-                if found:
-                    data_leaked_desc = "Sensitive markers detected: " + ", ".join(found)
-                    for pattern in found:
-                        clean_pattern = pattern.strip(r"\b")
-                        context_text = re.sub(clean_pattern, "[REDACTED]", context_text, flags=re.IGNORECASE)
-
-                # Generate model response
-                full_prompt = self.aec_prompt.format(
-                    context=context_text,
-                    conversation_history="No prior conversation",
-                    question=transformed_question
+        batch_size = max(1, int(self.batch_size))
+        semaphore = asyncio.Semaphore(max(1, int(self.concurrency)))
+        results_file = os.path.join(self.output_folder, "test_results.jsonl")
+        blocked = 0
+
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+
+        with open(results_file, "w", encoding="utf-8") as out, \
+                tqdm(total=total_prompts, desc="Testing prompts") as progress:
+            for start in range(0, total_prompts, batch_size):
+                batch = list(enumerate(self.test_prompts2[start:start + batch_size], start + 1))
+
+                # Transform the micro-batch concurrently
+                transformed = await asyncio.gather(
+                    *(bounded(self.query_transformer.transform(attack.get("prompt", ""))) for _, attack in batch)
                 )
-                model_response = self.model.generate_response(full_prompt)
-
-                # Classify
-                classification = self.classifier.classify(original_question, model_response)
-                is_question_malicious = classification.get("is_question_malicious", False)
-                question_comment = classification.get("question_comment", "")
-                response_safe_flag = classification.get("response_safe", True)
-                response_safety_score = classification.get("response_safety", 10)
-                response_comment = classification.get("response_comment", "")
-                classifier_leakage = classification.get("data_leaked", "None")
-
-                # Merge leakage info
-                if data_leaked_desc != "None" and classifier_leakage != "None":
-                    data_leaked_desc += " | Classifier: " + str(classifier_leakage)
-                elif classifier_leakage != "None":
-                    data_leaked_desc = "Classifier: " + str(classifier_leakage)
-
-                status = "BLOCKED" if is_question_malicious else "PROCESSED"
-
-            # Append results
-            record = {
-                "attack": attack_name,
-                "original_question": original_question,
-                "transformed_question": transformed_question,
-                "retrieved_contexts": context_text,
-                "model_response": model_response,
-                "is_question_malicious": is_question_malicious,
-                "question_comment": question_comment,
-                "response_safe": response_safe_flag,
-                "response_safety": response_safety_score,
-                "data_leaked": data_leaked_desc,
-                "response_comment": response_comment
-            }
-            results.append(record)
-
-            # Print per prompt summary
-            print(f"Transformed Query: {transformed_question}")
-            print(f"Blocked: {is_question_malicious}")
-            print(f"Sensitive Data Detected: {data_leaked_desc}")
-            print(f"Model Response: {model_response[:150]}{'...' if len(model_response) > 150 else ''}")
-            print(f"Status: {status}\n{'-'*60}\n")
-
-        # Save Excel after all prompts
-        self._save_results(results, total_prompts)
-
-    def _save_results(self, results: list, total_prompts: int):
-        """Save test results to Excel file."""
-        output_excel_file = os.path.join(self.output_folder, "test_results.xlsx")
-        df = pd.DataFrame(results)
-
-        with pd.ExcelWriter(output_excel_file, engine="openpyxl") as writer:
-            df.to_excel(writer, sheet_name="Test_Results", index=False)
-
-            summary_df = pd.DataFrame([
-                {"Metric": "Total Tests", "Value": total_prompts},
-                {"Metric": "Blocked (Malicious)", "Value": sum(r['is_question_malicious'] for r in results)},
-                {"Metric": "Processed (Safe)", "Value": total_prompts - sum(r['is_question_malicious'] for r in results)}
-            ])
-            summary_df.to_excel(writer, sheet_name="Summary", index=False)
-
-        print(f"\nTesting complete. Excel saved to {output_excel_file}")
+
+                # Embed and search all non-blocked queries of the batch in one call
+                queries = [question for question, is_malicious in transformed
+                           if not self._is_blocked(question, is_malicious)]
+                # Run the batched encode/search in a worker thread so it does not block the event loop
+                contexts = iter(await asyncio.to_thread(self.rag_system.retrieve_batch, queries, 3))
+                retrieved = [None if self._is_blocked(question, is_malicious) else next(contexts)
+                             for question, is_malicious in transformed]
+
+                # gather returns results in submission order, so the report keeps prompt order
+                records = await asyncio.gather(*(
+                    bounded(self.process_attack(idx, attack, total_prompts, *transformed[i], retrieved[i]))
+                    for i, (idx, attack) in enumerate(batch)
+                ))
+
+                # Append the batch to the results log right away so a crash keeps finished tests
+                for record in records:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    blocked += bool(record["is_question_malicious"])
+                out.flush()
+                progress.update(len(batch))
+
+        # Build reports from the results log
+        self.model.save_cache()
+        self._save_results(results_file, total_prompts, blocked)
+
+    def _is_blocked(self, transformed_question: str, is_malicious: bool) -> bool:
+        return is_malicious or transformed_question in [self.deny_message, self.invalid_query_message]
+
+    async def process_attack(self, idx: int, attack: dict, total_prompts: int, transformed_question: str,
+                             is_malicious: bool, retrieved_list: list) -> dict:
+        """Run one transformed test prompt through generation/classification and return its result record."""
+        attack_name = attack.get("attack_name", f"Prompt_{idx}")
+        original_question = attack.get("prompt", "")
+
+        # Defaults
+        context_text = "No context found."
+        model_response = ""
+        data_leaked_desc = "None"
+        response_safe_flag = True
+        response_safety_score = 10
+        question_comment = ""
+        response_comment = ""
+        is_question_malicious = is_malicious
+
+        if self._is_blocked(transformed_question, is_malicious):
+            model_response = self.deny_message
+            question_comment = "Malicious query blocked by transformer."
+            response_comment = "No data retrieval or response generation performed."
+            data_leaked_desc = "None - blocked before data access"
+            context_text = "BLOCKED"
+            status = "BLOCKED"
+        else:
+            # Retrieved context (batched in run_tests)
+            context_text = "\n\n".join(retrieved_list) if retrieved_list else "No context found."
+
+            # Detect sensitive data
+            found = self.detect_sensitive_strings(context_text)
+            if found:
+                data_leaked_desc = "Sensitive markers detected: " + ", ".join(found)
+                context_text = self.redact_sensitive_strings(context_text)
+
+            # Generate model response
+            full_prompt = self.aec_prompt.format(
+                context=context_text,
+                conversation_history="No prior conversation",
+                question=transformed_question
+            )
+            model_response = await self.model.generate_response(
+                full_prompt,
+                cache_key=transformed_question,
+                system_prompt=self.aec_system_prompt,
+                cache_scope=context_text
+            )
+
+            # Classify
+            classification = await self.classifier.classify(original_question, model_response)
+            is_question_malicious = classification.get("is_question_malicious", False)
+            question_comment = classification.get("question_comment", "")
+            response_safe_flag = classification.get("response_safe", True)
+            response_safety_score = classification.get("response_safety", 10)
+            response_comment = classification.get("response_comment", "")
+            classifier_leakage = classification.get("data_leaked", "None")
+
+            # Merge leakage info
+            if data_leaked_desc != "None" and classifier_leakage != "None":
+                data_leaked_desc += " | Classifier: " + str(classifier_leakage)
+            elif classifier_leakage != "None":
+                data_leaked_desc = "Classifier: " + str(classifier_leakage)
+
+            status = "BLOCKED" if is_question_malicious else "PROCESSED"
+
+        # Build result record
+        record = {
+            "attack": attack_name,
+            "original_question": original_question,
+            "transformed_question": transformed_question,
+            "retrieved_contexts": context_text,
+            "model_response": model_response,
+            "is_question_malicious": is_question_malicious,
+            "question_comment": question_comment,
+            "response_safe": response_safe_flag,
+            "response_safety": response_safety_score,
+            "data_leaked": data_leaked_desc,
+            "response_comment": response_comment
+        }
+
+        # Print the per prompt summary in one block once the test is done, so concurrent
+        # tests do not interleave; tqdm.write keeps the progress bar from run_tests intact
+        tqdm.write(
+            f"[{idx}/{total_prompts}] Testing: {attack_name}\n"
+            f"Transformed Query: {transformed_question}\n"
+            f"Blocked: {is_question_malicious}\n"
+            f"Sensitive Data Detected: {data_leaked_desc}\n"
+            f"Model Response: {model_response[:150]}{'...' if len(model_response) > 150 else ''}\n"
+            f"Status: {status}\n{'-'*60}\n"
+        )
+
+        return record
+
+    def _save_results(self, results_file: str, total_prompts: int, blocked: int):
+        """Build the Excel (streamed row by row) and optional Parquet reports from the JSONL results log."""
+        if self.save_excel:
+            output_excel_file = os.path.join(self.output_folder, "test_results.xlsx")
+            # constant_memory flushes each row as it is written instead of building the sheet in RAM
+            workbook = xlsxwriter.Workbook(output_excel_file, {
+                "constant_memory": True,
+                "strings_to_formulas": False,
+                "strings_to_urls": False
+            })
+            header_format = workbook.add_format({"bold": True, "border": 1})
+            try:
+                sheet = workbook.add_worksheet("Test_Results")
+                columns = None
+                with open(results_file, "rb") as f:
+                    for row, line in enumerate(f, 1):
+                        record = json_loads(line)
+                        if columns is None:
+                            columns = list(record.keys())
+                            sheet.write_row(0, 0, columns, header_format)
+                        # Classifier fields come straight from LLM JSON; xlsxwriter rejects lists/dicts
+                        sheet.write_row(row, 0, [
+                            value if value is None or isinstance(value, (bool, int, float, str)) else str(value)
+                            for value in (record.get(c) for c in columns)
+                        ])
+
+                summary = workbook.add_worksheet("Summary")
+                summary.write_row(0, 0, ["Metric", "Value"], header_format)
+                summary.write_row(1, 0, ["Total Tests", total_prompts])
+                summary.write_row(2, 0, ["Blocked (Malicious)", blocked])
+                summary.write_row(3, 0, ["Processed (Safe)", total_prompts - blocked])
+            finally:
+                workbook.close()
+            print(f"\nTesting complete. Excel saved to {output_excel_file}")
+
+        if self.save_parquet:
+            output_parquet_file = os.path.join(self.output_folder, "test_results.parquet")
+            with open(results_file, "rb") as f:
+                df = pd.DataFrame([json_loads(line) for line in f])
+            df.to_parquet(output_parquet_file, engine="pyarrow", compression="zstd", index=False)
+            print(f"Parquet saved to {output_parquet_file}")
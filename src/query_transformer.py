@@ -1,8 +1,12 @@
 # src/query_transformer.py
+import asyncio
+import re
 import yaml
 import os
 import google.generativeai as genai
 from dotenv import load_dotenv
+from .llm_retry import llm_retry, get_rate_limiter
+from .prompt_template import PromptTemplate
 load_dotenv()
 
 
@@ -25,11 +29,11 @@ class QueryTransformer:
         self.model = genai.GenerativeModel(model_name=model, generation_config=generation_config)
 
         # Load configuration - FIXED THIS PART
-        if hasattr(config_path_or_loader, "get"):  # ConfigLoader object
-            # Use the get method directly instead of accessing .data
-            prompts_section = config_path_or_loader.get("prompts", default={})
+        if hasattr(config_path_or_loader, "section"):  # ConfigLoader object
+            prompts_section = config_path_or_loader.section("prompts")
             self.prompt_template = prompts_section.get("query_transformation_prompt", 
                                                        "Please transform the query: {query}")
+            requests_per_second = config_path_or_loader.section("models").get("requests_per_second", 5)
         else:
             if not os.path.exists(config_path_or_loader):
                 raise FileNotFoundError(f"Config file not found: {config_path_or_loader}")
@@ -39,6 +43,12 @@ class QueryTransformer:
                 "query_transformation_prompt",
                 "Please transform the query: {query}"
             )
+            requests_per_second = (config.get("models") or {}).get("requests_per_second", 5)
+
+        self.prompt_template = PromptTemplate(self.prompt_template)
+
+        # Shares the Gemini request budget with AECModel
+        self.rate_limiter = get_rate_limiter("gemini", requests_per_second)
 
         # Malicious patterns to block immediately
         self.malicious_patterns = [
@@ -52,18 +62,18 @@ class QueryTransformer:
             r"login details",
             r"credentials",
         ]
+        # Patterns are matched as literal substrings; one compiled alternation scans the query once
+        self._malicious_re = re.compile(
+            "|".join(re.escape(p) for p in self.malicious_patterns if p)
+        ) if any(self.malicious_patterns) else None
 
     def is_malicious(self, query: str) -> bool:
         """Quick local check for malicious keywords."""
-        if not query:
+        if not query or self._malicious_re is None:
             return False
-        query_lower = query.lower()
-        for pattern in self.malicious_patterns:
-            if pattern and pattern in query_lower:
-                return True
-        return False
+        return self._malicious_re.search(query.lower()) is not None
 
-    def transform(self, query: str) -> tuple[str, bool]:
+    async def transform(self, query: str) -> tuple[str, bool]:
         """
         Transform query.
         Returns: (transformed_text, is_malicious)
@@ -76,7 +86,7 @@ class QueryTransformer:
         # Safe query → send to model
         prompt = self.prompt_template.format(query=query)
         try:
-            response = self.model.generate_content(prompt)
+            response = await self._generate(prompt)
             text = getattr(response, "text", None) or query
         except Exception as e:
             print(f"Error calling Gemini API: {e}")
@@ -89,9 +99,14 @@ class QueryTransformer:
         print(f"SAFE: Query transformed successfully: {query[:60]}...")
         return (text, False)
 
+    @llm_retry
+    async def _generate(self, prompt: str):
+        async with self.rate_limiter:
+            return await self.model.generate_content_async(prompt)
+
 
 # ======= Direct Test =======
-if __name__ == "__main__":
+async def _direct_test():
     transformer = QueryTransformer()
 
     safe_queries = [
@@ -108,14 +123,18 @@ if __name__ == "__main__":
 
     print("=== SAFE QUERIES ===")
     for q in safe_queries:
-        t, m = transformer.transform(q)
+        t, m = await transformer.transform(q)
         print(f"Query: {q}")
         print(f"Malicious: {m}")
         print(f"Transformed: {t[:80]}...\n")
 
     print("=== MALICIOUS QUERIES ===")
     for q in malicious_queries:
-        t, m = transformer.transform(q)
+        t, m = await transformer.transform(q)
         print(f"Query: {q}")
         print(f"Malicious: {m}")
-        print(f"Transformed: {t[:80]}...\n")
\ No newline at end of file
+        print(f"Transformed: {t[:80]}...\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(_direct_test())
\ No newline at end of file
@@ -1,69 +1,275 @@
 import os
+import re
 import glob
+import hashlib
+import platform
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 import faiss
-import pdfplumber
+import pymupdf
+from .semantic_cache import SemanticCache
+
+
+def _chunk_text(text: str, chunk_size=80, overlap=10):
+    words = text.split()
+    step = chunk_size - overlap
+    return [" ".join(words[start:start + chunk_size]) for start in range(0, len(words), step)]
+
+
+def _parse_file(file: str) -> list:
+    """Read one .txt or .pdf file and return its chunks (module-level so worker processes can pickle it)."""
+    if file.lower().endswith(".pdf"):
+        with pymupdf.open(file) as pdf:
+            text = "\n\n".join(page.get_text("text") for page in pdf).strip()
+    else:
+        with open(file, "r", encoding="utf-8") as f:
+            text = f.read().strip()
+    if not text:
+        return []
+
+    chunks = []
+    paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
+    for para in paragraphs:
+        chunks.extend(_chunk_text(para))
+    return chunks
+
 
 class RAGSystem:
+    # Index selection by corpus size (number of chunks)
+    FLAT_INDEX_MAX_CHUNKS = 2000
+    HNSW_INDEX_MAX_CHUNKS = 100000
+    IVF_NPROBE = 16
+    # Bump when chunking/parsing changes so stale corpus caches are ignored
+    CACHE_VERSION = 2
+
     def __init__(self, config):
-        self.docs_folder = config.get("paths", "docs_folder", "docs")
-        embedding_model = config.get("models", "embedding_model", "all-MiniLM-L6-v2")
-        self.model = SentenceTransformer(embedding_model)
+        paths = config.section("paths")
+        models = config.section("models")
+        self.docs_folder = paths.get("docs_folder", "docs")
+        self.models_folder = paths.get("models_folder", "models")
+        self.embedding_model = models.get("embedding_model", "all-MiniLM-L6-v2")
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.embedding_precision, self.model = self._load_embedding_model(models.get("embedding_precision", "auto"))
 
         self.chunks = []
-        self.chunk_embeddings = []
+        self.chunk_embeddings = None
         self.index = None
 
-        self._load_docs()
-        self._create_index()
+        # In-memory retrieval cache (query -> chunk indices), one per top_k
+        cache_config = config.section("cache")
+        self.cache_retrievals = cache_config.get("enabled", True)
+        self.retrieval_threshold = cache_config.get("retrieval_similarity_threshold", 0.98)
+        self._retrieval_caches = {}
 
-    def _chunk_text(self, text: str, chunk_size=80, overlap=10):
-        words = text.split()
-        chunks = []
-        start = 0
-        while start < len(words):
-            end = min(start + chunk_size, len(words))
-            chunks.append(" ".join(words[start:end]))
-            start += chunk_size - overlap
-        return chunks
+        # Reuse chunks/embeddings/index from a previous run if the corpus is unchanged
+        # Named per embedding setup so caches for other models/precisions can share docs_folder
+        self._cache_prefix = ".cache_" + re.sub(
+            r"[^\w.-]", "_", f"{os.path.basename(self.embedding_model)}_{self.embedding_precision}"
+        )
+        cache_base = os.path.join(self.docs_folder, f"{self._cache_prefix}_{self._corpus_hash()}")
+        if os.path.exists(cache_base + ".npz") and os.path.exists(cache_base + ".faiss"):
+            self._load_cache(cache_base)
+        else:
+            self._load_docs()
+            self._create_index()
+            self._save_cache(cache_base)
 
-    def _load_docs(self):
+    def _load_embedding_model(self, precision: str):
+        """
+        Load the embedding model at the requested precision ('auto', 'fp32', 'fp16', 'int8').
+        'auto' means fp16 on CUDA and, on CPU, int8 ONNX when optimum/onnxruntime are installed
+        and the CPU has AVX-512 VNNI or is ARM64; other CPUs stay on fp32.
+        Returns: (precision_used, model)
+        """
+        if self.device == "cuda":
+            model = SentenceTransformer(self.embedding_model, device="cuda")
+            if precision in ("auto", "fp16"):
+                return "fp16", model.half()
+            return "fp32", model
+
+        if precision in ("auto", "int8"):
+            quantization = self._int8_quantization_config(allow_avx2=precision == "int8")
+            if quantization is None:
+                print("Warning: no AVX-512 VNNI or ARM64 support for int8 embeddings; using fp32.")
+            else:
+                try:
+                    return f"int8-{quantization}", self._load_int8_model(quantization)
+                except ImportError as e:
+                    print(f"Warning: int8 embedding backend unavailable ({e}); using fp32.")
+                except Exception as e:
+                    print(f"Warning: int8 embedding export failed ({e}); using fp32.")
+        return "fp32", SentenceTransformer(self.embedding_model, device="cpu")
+
+    @staticmethod
+    def _int8_quantization_config(allow_avx2: bool = False):
+        """
+        ONNX dynamic quantization config matching this CPU: 'arm64', 'avx512_vnni',
+        or 'avx2' when allow_avx2 is set (it loses accuracy without VNNI). None otherwise.
+        """
+        if platform.machine().lower() in ("arm64", "aarch64"):
+            return "arm64"
+        try:
+            with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+                flags = set(f.read().split())
+        except OSError:
+            return None
+        if "avx512_vnni" in flags:
+            return "avx512_vnni"
+        if allow_avx2 and "avx2" in flags:
+            return "avx2"
+        return None
+
+    def _load_int8_model(self, quantization: str):
+        """Dynamically quantized (int8) ONNX export for the given config, built once under models_folder."""
+        import onnxruntime  # noqa: F401 - fail early with ImportError if the ONNX backend is missing
+        import optimum.onnxruntime  # noqa: F401
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        model_dir = os.path.join(self.models_folder, f"{os.path.basename(self.embedding_model)}-int8")
+        file_name = f"onnx/model_qint8_{quantization}.onnx"
+        if not os.path.exists(os.path.join(model_dir, file_name)):
+            model = SentenceTransformer(self.embedding_model, device="cpu", backend="onnx")
+            model.save(model_dir)
+            export_dynamic_quantized_onnx_model(model, quantization, model_dir)
+        return SentenceTransformer(model_dir, device="cpu", backend="onnx", model_kwargs={"file_name": file_name})
+
+    def _corpus_files(self):
         txt_files = glob.glob(os.path.join(self.docs_folder, "*.txt"))
         pdf_files = glob.glob(os.path.join(self.docs_folder, "*.pdf"))
-        # Process text files
+        return txt_files, pdf_files
+
+    def _corpus_hash(self) -> str:
+        """Fingerprint of the docs (name, mtime, size) and the embedding setup."""
+        h = hashlib.sha256(
+            f"{self.CACHE_VERSION}|{self.embedding_model}|{self.embedding_precision}".encode("utf-8")
+        )
+        txt_files, pdf_files = self._corpus_files()
+        for path in sorted(txt_files + pdf_files):
+            stat = os.stat(path)
+            h.update(f"{os.path.basename(path)}|{stat.st_mtime_ns}|{stat.st_size}\n".encode("utf-8"))
+        return h.hexdigest()[:16]
+
+    def _load_cache(self, cache_base: str):
+        with np.load(cache_base + ".npz", allow_pickle=True) as data:
+            self.chunks = data["chunks"].tolist()
+            self.chunk_embeddings = data["embeddings"]
+        self.index = faiss.read_index(cache_base + ".faiss")
+        if isinstance(self.index, faiss.IndexIVF):
+            self.index.nprobe = self.IVF_NPROBE
+
+    def _save_cache(self, cache_base: str):
+        try:
+            np.savez_compressed(
+                cache_base + ".npz",
+                chunks=np.array(self.chunks, dtype=object),
+                embeddings=self.chunk_embeddings
+            )
+            faiss.write_index(self.index, cache_base + ".faiss")
+        except OSError as e:
+            print(f"Warning: could not write RAG cache to {self.docs_folder}: {e}")
+            return
+
+        # Drop caches of earlier corpus versions built with this same embedding setup,
+        # plus unprefixed '.cache_<hash>' files from the old naming scheme
+        current = {cache_base + ".npz", cache_base + ".faiss"}
+        corpus_hash = "[0-9a-f]" * 16
+        stale = glob.glob(os.path.join(self.docs_folder, f"{self._cache_prefix}_{corpus_hash}.*"))
+        stale += glob.glob(os.path.join(self.docs_folder, f".cache_{corpus_hash}.*"))
+        for path in stale:
+            if path not in current:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _load_docs(self):
+        txt_files, pdf_files = self._corpus_files()
         for file in txt_files:
-            with open(file, "r", encoding="utf-8") as f:
-                text = f.read().strip()
-                if not text:
-                    continue
-                paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
-                for para in paragraphs:
-                    self.chunks.extend(self._chunk_text(para))
-        # Process PDF files
-        for file in pdf_files:
-            with pdfplumber.open(file) as pdf:
-                text = ""
-                for page in pdf.pages:
-                    text += page.extract_text() or ""
-                if not text:
-                    continue
-                paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
-                for para in paragraphs:
-                    self.chunks.extend(self._chunk_text(para))
-
-    def _embed_chunk(self, chunk: str):
-        return self.model.encode(chunk, convert_to_numpy=True).astype(np.float32)
+            self.chunks.extend(_parse_file(file))
+        # PDF text extraction is the slow part. PyMuPDF is not thread-safe, so PDFs are
+        # parsed in worker processes; map() keeps the chunk order
+        if len(pdf_files) > 1:
+            with ProcessPoolExecutor(max_workers=min(len(pdf_files), os.cpu_count() or 1)) as executor:
+                for chunks in executor.map(_parse_file, pdf_files):
+                    self.chunks.extend(chunks)
+        else:
+            for file in pdf_files:
+                self.chunks.extend(_parse_file(file))
 
     def _create_index(self):
         if not self.chunks:
             raise ValueError(f"No chunks found in {self.docs_folder}.")
-        self.chunk_embeddings = [self._embed_chunk(c) for c in self.chunks]
-        dim = self.chunk_embeddings[0].shape[0]
-        self.index = faiss.IndexFlatL2(dim)
-        self.index.add(np.array(self.chunk_embeddings))
+        # One batched encode; normalized vectors make inner product == cosine similarity
+        self.chunk_embeddings = self.model.encode(
+            self.chunks,
+            batch_size=64,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=True
+        ).astype(np.float32, copy=False)
+        self.index = self._build_index(self.chunk_embeddings)
+
+    def _build_index(self, embeddings: np.ndarray):
+        """
+        Exact search for small corpora, HNSW graph search for medium ones and
+        IVF-PQ (compressed, approximate) for large ones. All use inner product.
+        """
+        n, dim = embeddings.shape
+        if n < self.FLAT_INDEX_MAX_CHUNKS:
+            index = faiss.IndexFlatIP(dim)
+        elif n < self.HNSW_INDEX_MAX_CHUNKS:
+            index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 200
+        else:
+            nlist = int(4 * np.sqrt(n))
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, dim // 4, 8, faiss.METRIC_INNER_PRODUCT)
+            index.train(embeddings)
+            index.nprobe = self.IVF_NPROBE
+        index.add(embeddings)
+        return index
+
+    def retrieve_batch(self, queries: list, top_k=3) -> list:
+        """
+        Retrieve the top_k chunks for each query with one encode and one index search.
+        Queries seen before (exactly, or within the retrieval similarity threshold)
+        reuse their earlier results; exact repeats skip encoding as well.
+        """
+        if not queries:
+            return []
+        cache = None
+        if self.cache_retrievals:
+            if top_k not in self._retrieval_caches:
+                self._retrieval_caches[top_k] = SemanticCache(self.model, threshold=self.retrieval_threshold)
+            cache = self._retrieval_caches[top_k]
+
+        hits = [cache.get(q) if cache else None for q in queries]
+        pending = [i for i, hit in enumerate(hits) if hit is None]
+        if pending:
+            query_embeddings = self.model.encode(
+                [queries[i] for i in pending], batch_size=32, convert_to_numpy=True, normalize_embeddings=True
+            ).astype(np.float32, copy=False)
+
+            to_search = []
+            for row, i in enumerate(pending):
+                if cache:
+                    hits[i] = cache.get(queries[i], query_embeddings[row:row + 1])
+                if hits[i] is None:
+                    to_search.append(row)
+
+            if to_search:
+                # Search the encoded block as-is unless some rows were cache hits
+                search_embeddings = query_embeddings if len(to_search) == len(pending) else query_embeddings[to_search]
+                scores, indices = self.index.search(search_embeddings, top_k)
+                for row, found in zip(to_search, indices):
+                    i = pending[row]
+                    hits[i] = tuple(int(j) for j in found if j != -1)
+                    if cache:
+                        cache.put(queries[i], hits[i], query_embeddings[row:row + 1])
+
+        return [[self.chunks[j] for j in hit] for hit in hits]
 
     def retrieve(self, query: str, top_k=3):
-        query_embedding = self._embed_chunk(query)
-        distances, indices = self.index.search(np.array([query_embedding]), top_k)
-        return [self.chunks[i] for i in indices[0]]
+        return self.retrieve_batch([query], top_k)[0]
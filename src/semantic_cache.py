@@ -0,0 +1,104 @@
+# src/semantic_cache.py
+import os
+import pickle
+import hashlib
+import numpy as np
+import faiss
+
+
+class SemanticCache:
+    """
+    Key/value cache with exact-match lookup and an embedding-similarity fallback.
+    Exact hits are keyed by the SHA-256 of the key text; similarity hits use a
+    FAISS inner-product index over normalized embeddings (i.e. cosine similarity).
+    Similarity lookups only see entries stored under the same scope, so callers
+    can restrict fuzzy matches to entries built from identical inputs.
+    """
+    def __init__(self, embedder, threshold: float = 0.95, path: str = None):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.path = path
+
+        self.exact = {}
+        self.values = []
+        self.embeddings = []
+        self.scopes = []
+        self.partitions = {}
+
+        if self.path and os.path.exists(self.path):
+            self._load()
+
+    @staticmethod
+    def _hash(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed text as a normalized (1, dim) float32 array."""
+        embedding = self.embedder.encode([text], convert_to_numpy=True, normalize_embeddings=True)
+        return embedding.astype(np.float32, copy=False)
+
+    def get(self, key: str, embedding: np.ndarray = None, scope: str = ""):
+        """
+        Return the cached value for key, or for the closest embedding stored under
+        the same scope if its cosine similarity reaches the threshold. None on a miss.
+        """
+        value = self.exact.get(self._hash(key))
+        partition = self.partitions.get(self._hash(scope))
+        if value is not None or embedding is None or partition is None:
+            return value
+
+        index, values = partition
+        scores, indices = index.search(embedding, 1)
+        if indices[0][0] != -1 and scores[0][0] >= self.threshold:
+            return values[indices[0][0]]
+        return None
+
+    def put(self, key: str, value, embedding: np.ndarray = None, scope: str = ""):
+        """Store value under key and, if given, under its embedding within scope."""
+        self.exact[self._hash(key)] = value
+        if embedding is not None:
+            self._add_embedding(embedding, value, self._hash(scope))
+
+    def _add_embedding(self, embedding: np.ndarray, value, scope_hash: str):
+        if scope_hash not in self.partitions:
+            self.partitions[scope_hash] = (faiss.IndexFlatIP(embedding.shape[1]), [])
+        index, values = self.partitions[scope_hash]
+        index.add(embedding)
+        values.append(value)
+        self.embeddings.append(embedding[0])
+        self.values.append(value)
+        self.scopes.append(scope_hash)
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            data = pickle.load(f)
+        self.exact = data.get("exact", {})
+        # Similarity entries saved without scopes cannot be trusted; keep only exact hits
+        scopes = data.get("scopes")
+        if scopes is None:
+            return
+        grouped = {}
+        for embedding, value, scope_hash in zip(data.get("embeddings", []), data.get("values", []), scopes):
+            grouped.setdefault(scope_hash, []).append((embedding, value))
+        for scope_hash, entries in grouped.items():
+            # Rebuild each partition from one contiguous block instead of row by row
+            stacked = np.ascontiguousarray(np.vstack([e for e, _ in entries]), dtype=np.float32)
+            index = faiss.IndexFlatIP(stacked.shape[1])
+            index.add(stacked)
+            self.partitions[scope_hash] = (index, [v for _, v in entries])
+            self.embeddings.extend(e for e, _ in entries)
+            self.values.extend(v for _, v in entries)
+            self.scopes.extend(scope_hash for _ in entries)
+
+    def save(self):
+        """Persist the cache to disk (no-op for in-memory caches)."""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "wb") as f:
+            pickle.dump({
+                "exact": self.exact,
+                "embeddings": self.embeddings,
+                "values": self.values,
+                "scopes": self.scopes
+            }, f)